@@ -0,0 +1,9 @@
+# Tipos usados pelo Cython ao compilar inline_md.py (ignorado pelo Python).
+import cython
+
+@cython.locals(
+    s=str, out=list, stack=list, inner=str,
+    i=Py_ssize_t, j=Py_ssize_t, n=Py_ssize_t, nl=Py_ssize_t, star=Py_ssize_t,
+    run=Py_ssize_t, count=Py_ssize_t, pos=Py_ssize_t, ch=Py_UCS4,
+)
+cpdef str markdown_inline_to_html(text)
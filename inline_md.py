@@ -0,0 +1,106 @@
+# cython: annotation_typing=False
+"""
+Conversão de markdown inline (***, **, *) em HTML.
+
+Fica num módulo separado para poder ser compilado com Cython sem mudar
+nada no código: `cythonize -i inline_md.py` gera uma extensão (.so/.pyd)
+que o Python importa no lugar deste arquivo. Sem compilar, roda igual.
+"""
+from html import escape
+
+_OPEN_TAGS = {1: "<em>", 2: "<strong>", 3: "<strong><em>"}
+_CLOSE_TAGS = {1: "</em>", 2: "</strong>", 3: "</em></strong>"}
+
+
+def markdown_inline_to_html(text: str) -> str:
+    """
+    Converte ***bold+italic***, **bold** e *italic* em HTML.
+    NÃO inventa formatação, apenas converte o que já vier com markdown.
+
+    Uma única varredura: cada sequência de 1/2/3 asteriscos fecha a marcação
+    aberta no topo da pilha ou abre uma nova. Marcações que nunca fecham
+    (ou que atravessam uma quebra de linha) voltam a ser asteriscos literais.
+    """
+    if text is None:
+        return ""
+
+    # caso comum: sem nenhum asterisco, só escapar
+    if "*" not in text:
+        return escape(text)
+
+    # escapa caracteres HTML perigosos
+    s = escape(text)
+
+    out = []
+    append = out.append
+    # cada item: (posição do placeholder em out, nº de * ainda aberto, tag interna já aberta)
+    stack = []
+
+    i, n = 0, len(s)
+    # próxima quebra de linha: só importa se houver marcação aberta ao cruzá-la
+    nl = s.find("\n")
+    if nl < 0:
+        nl = n
+
+    # salta de asterisco em asterisco; o texto entre eles é copiado de uma vez
+    star = s.find("*")
+    while star >= 0:
+        if star > i:
+            append(s[i:star])
+
+        if nl < star:
+            # nenhuma marcação atravessa a quebra de linha: as abertas voltam a ser literais
+            if stack:
+                for pos, count, inner in stack:
+                    out[pos] = "*" * count + inner
+                stack.clear()
+            nl = s.find("\n", star)
+            if nl < 0:
+                nl = n
+
+        j = star + 1
+        while j < n:
+            ch = s[j]
+            if ch != "*":
+                break
+            j += 1
+        run = j - star
+        i = j
+
+        if run > 3:
+            append("*" * run)
+            run = 0
+
+        # tenta fechar as marcações abertas
+        while run and stack:
+            pos, count, inner = stack[-1]
+            if count == run or (
+                count < run and len(stack) > 1 and stack[-2][1] == run - count
+            ):
+                # fecha o topo (e, no caso de ***, também a marcação de baixo)
+                out[pos] = _OPEN_TAGS[count] + inner
+                append(_CLOSE_TAGS[count])
+                run -= count
+                stack.pop()
+            elif count == 3:
+                # *** fechado em partes: o trecho fechado agora é a tag interna
+                stack[-1] = (pos, 3 - run, _OPEN_TAGS[run])
+                append(_CLOSE_TAGS[run])
+                run = 0
+            else:
+                break
+
+        # o que sobrou abre uma nova marcação
+        if run:
+            stack.append((len(out), run, ""))
+            append("")
+
+        star = s.find("*", i)
+
+    if i < n:
+        append(s[i:])
+
+    # marcações que nunca fecharam voltam a ser literais
+    for pos, count, inner in stack:
+        out[pos] = "*" * count + inner
+    return "".join(out)
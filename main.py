@@ -1,12 +1,17 @@
 import streamlit as st
 from PIL import Image
-import tempfile
+import io
 import os
-import re
-import json
-from html import escape
-import base64
-from openai import OpenAI
+import asyncio
+import hashlib
+import diskcache
+import httpx
+import threading
+import time
+from concurrent import futures
+from openai import AsyncOpenAI
+from inline_md import markdown_inline_to_html
+from model_json import extract_json_from_model_output
 
 # =========================
 # Configurar página
@@ -15,51 +20,73 @@ st.set_page_config(page_title="OCR com GPT-4o (multi-página)", layout="wide")
 st.title("📸 Extrator de Texto de Imagens com GPT-4o")
 st.write("Envie 1 ou 2 imagens de páginas e gere HTML com a formatação visual detectada.")
 
-# =========================
-# Utilidades
-# =========================
-def markdown_inline_to_html(text: str) -> str:
-    """
-    Converte ***bold+italic***, **bold** e *italic* em HTML.
-    NÃO inventa formatação, apenas converte o que já vier com markdown.
-    """
-    if text is None:
-        return ""
+# maior lado (px) e qualidade JPEG das páginas enviadas ao modelo
+MAX_IMAGE_SIDE = 2000
+JPEG_QUALITY = 85
+# maior lado (px) das miniaturas da pré-visualização
+PREVIEW_SIDE = 800
 
-    # escapa caracteres HTML perigosos
-    s = escape(text)
+# páginas analisadas ao mesmo tempo (limite de requisições simultâneas à API)
+MAX_CONCURRENT_PAGES = 8
 
-    # ***bold+italic***
-    s = re.sub(r"\*\*\*(.+?)\*\*\*", r"<strong><em>\1</em></strong>", s)
+# intervalo (s) entre atualizações do texto parcial na tela
+PROGRESS_INTERVAL = 0.1
 
-    # **bold**
-    s = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", s)
+# conexões HTTP/2 mantidas abertas com a API (as páginas compartilham a conexão);
+# o padrão do httpx fecha conexões ociosas em 5 s, antes de o usuário clicar
+KEEPALIVE_EXPIRY = 300
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=4, keepalive_expiry=KEEPALIVE_EXPIRY)
 
-    # *italic*
-    s = re.sub(r"\*(.+?)\*", r"<em>\1</em>", s)
-
-    return s
+# =========================
+# Utilidades
+# =========================
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
 
 
-def extract_json_from_model_output(text: str):
-    """Extrai JSON mesmo se vier com ruído ou ```json ...```."""
-    if not text:
-        raise json.JSONDecodeError("empty", "", 0)
+def _image_size(data: bytes):
+    """
+    Lê largura/altura direto do cabeçalho de um PNG ou JPEG, sem o PIL.
+    Devolve None para outros formatos (ou cabeçalho ilegível).
+    """
+    if data.startswith(_PNG_MAGIC):
+        # IHDR: largura e altura logo após a assinatura
+        if len(data) < 24:
+            return None
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+
+    if data.startswith(b"\xff\xd8"):
+        # percorre os segmentos até o SOF (start of frame)
+        i, n = 2, len(data)
+        while i + 9 < n:
+            if data[i] != 0xFF:
+                return None
+            marker = data[i+1]
+            if marker == 0xFF:
+                i += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                i += 2
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                h = int.from_bytes(data[i+5:i+7], "big")
+                w = int.from_bytes(data[i+7:i+9], "big")
+                return w, h
+            i += 2 + int.from_bytes(data[i+2:i+4], "big")
 
-    s = text.strip()
+    return None
 
-    fence = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", s)
-    if fence:
-        s = fence.group(1).strip()
-    else:
-        if s.startswith("["):
-            a, b = s.find("["), s.rfind("]")
-            s = s[a:b+1]
-        else:
-            a, b = s.find("{"), s.rfind("}")
-            s = s[a:b+1]
 
-    return json.loads(s)
+def _flatten_to_rgb(img):
+    """
+    Converte para RGB (JPEG não tem alfa) compondo a transparência sobre branco;
+    um convert("RGB") direto deixaria o fundo transparente preto.
+    """
+    if img.mode in {"RGBA", "LA", "PA"} or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, "white")
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return img.convert("RGB")
 
 
 def coerce_to_sections_schema(data):
@@ -68,17 +95,19 @@ def coerce_to_sections_schema(data):
         # compat: alguns modelos usam "content" em vez de "text"
         for sec in data["sections"]:
             for it in sec.get("items", []):
-                if it.get("text") is None and it.get("content") is not None:
-                    it["text"] = it["content"]
+                get = it.get
+                if get("text") is None:
+                    content = get("content")
+                    if content is not None:
+                        it["text"] = content
         return data
 
     if isinstance(data, list):
-        items = []
-        for it in data:
-            if not isinstance(it, dict):
-                continue
-            txt = it.get("text") or it.get("content") or ""
-            items.append({"type": (it.get("type") or "p"), "text": txt})
+        items = [
+            {"type": it.get("type") or "p", "text": it.get("text") or it.get("content") or ""}
+            for it in data
+            if isinstance(it, dict)
+        ]
 
         heading = ""
         if items and items[0]["type"] in {"h1", "h2", "h3"}:
@@ -98,19 +127,58 @@ def load_openai():
     if not key:
         st.error("❌ OPENAI_API_KEY não definida. Configure antes de continuar.")
         st.stop()
-    return OpenAI(api_key=key)
 
-client = load_openai()
+    # event loop próprio, vivo durante todo o processo: o pool HTTP/2 do cliente
+    # assíncrono fica preso a ele, então pode ser aquecido e reaproveitado entre cliques
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="openai-loop", daemon=True).start()
+
+    async def create_client():
+        return AsyncOpenAI(
+            api_key=key,
+            http_client=httpx.AsyncClient(http2=True, limits=HTTP_LIMITS),
+        )
+
+    aclient = asyncio.run_coroutine_threadsafe(create_client(), loop).result()
+
+    async def ping():
+        try:
+            await aclient.models.list()
+        except Exception:
+            pass
+
+    last_warm = [0.0]
+
+    def warm_up():
+        """Abre (ou renova) a conexão com a API, no máximo uma vez por meia expiração."""
+        now = time.monotonic()
+        if last_warm[0] and now - last_warm[0] < KEEPALIVE_EXPIRY / 2:
+            return
+        last_warm[0] = now
+        asyncio.run_coroutine_threadsafe(ping(), loop)
+
+    # abre TCP+TLS já na inicialização, fora do clique no botão
+    warm_up()
+    return loop, aclient, warm_up
+
+loop, aclient, warm_up = load_openai()
+
+
+@st.cache_resource
+def load_cache():
+    # resultados de OCR por página, persistidos entre execuções
+    return diskcache.Cache(".ocr_cache")
+
+ocr_cache = load_cache()
 
 # =========================
 # GPT-4o (multi-page)
 # =========================
-def analyze_text_formatting(image_paths: list[str]):
-    # prompt mais rígido para respeitar a formatação visual
-    prompt = """
+# prompt mais rígido para respeitar a formatação visual
+OCR_PROMPT = """
 TASK:
-Analyze the IMAGE(S) and reproduce ONLY the REAL inline formatting exactly as it appears.
-Multiple images represent consecutive pages of ONE document. Read them in order (page 1 → page 2).
+Analyze the IMAGE and reproduce ONLY the REAL inline formatting exactly as it appears.
+The image is one page of a document; other pages are processed separately.
 
 INLINE FORMATTING RULES:
 1) Bold → use **bold** ONLY if the text is visually thicker/darker.
@@ -156,20 +224,27 @@ Return ONLY valid JSON in this exact structure:
 }
 """
 
-    content = [{"type": "input_text", "text": prompt}]
 
-    # append pages in order
-    for path in image_paths:
-        with open(path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-        content.append({"type": "input_image", "image_url": f"data:image/png;base64,{b64}"})
+def _image_content(file_id: str) -> list[dict]:
+    """Monta o conteúdo (prompt + imagem já enviada) de uma página."""
+    return [
+        {"type": "input_text", "text": OCR_PROMPT},
+        {"type": "input_image", "file_id": file_id, "detail": "high"},
+    ]
+
+
+async def _upload_page(data: bytes) -> str:
+    """Envia os bytes da página pela Files API (sem base64) e devolve o file_id."""
+    if data.startswith(_PNG_MAGIC):
+        name, mime = "page.png", "image/png"
+    else:
+        name, mime = "page.jpg", "image/jpeg"
+    uploaded = await aclient.files.create(file=(name, data, mime), purpose="vision")
+    return uploaded.id
 
-    resp = client.responses.create(
-        model="gpt-4o",
-        temperature=0,
-        input=[{"role": "user", "content": content}],
-    )
 
+def _response_text(resp):
+    """Extrai o texto de uma resposta da Responses API."""
     # tenta pegar texto direto
     response_text = getattr(resp, "output_text", None)
 
@@ -181,17 +256,149 @@ Return ONLY valid JSON in this exact structure:
         except Exception:
             response_text = None
 
+    return response_text
+
+
+class OCRError(Exception):
+    """Falha ao interpretar a resposta de uma página (com o texto bruto, se houver)."""
+
+    def __init__(self, message, response_text=None):
+        super().__init__(message)
+        self.response_text = response_text
+
+
+def _parse_page(response_text):
+    """Converte o texto de uma página em { sections: [...] } (ou levanta OCRError)."""
     if not response_text:
-        st.error("❌ Resposta vazia da API.")
-        return None
+        raise OCRError("❌ Resposta vazia da API.")
 
     try:
         raw = extract_json_from_model_output(response_text)
         return coerce_to_sections_schema(raw)
     except Exception:
-        st.error("❌ Não foi possível extrair JSON.")
-        st.code(response_text)
-        return None
+        raise OCRError("❌ Não foi possível extrair JSON.", response_text)
+
+
+def _page_cache_key(data: bytes) -> str:
+    """Impressão digital de uma página: prompt + bytes da imagem."""
+    return hashlib.sha256(OCR_PROMPT.encode() + b"|" + data).hexdigest()
+
+
+# tarefas soltas no event loop do cliente (referência forte até terminarem)
+_background_tasks = set()
+
+
+async def _delete_file(file_id: str):
+    """Apaga um upload que não será mais usado (falhas são ignoradas)."""
+    try:
+        await aclient.files.delete(file_id)
+    except Exception:
+        pass
+
+
+async def _stream_page(data: bytes, on_delta):
+    """Envia uma página via streaming, repassando o texto parcial a on_delta."""
+    # o upload só vive durante a análise: o resultado já fica no cache de OCR,
+    # então não há file_id guardado que possa expirar ou acumular na conta
+    file_id = await _upload_page(data)
+    try:
+        partial = ""
+        async with aclient.responses.stream(
+            model="gpt-4o",
+            temperature=0,
+            input=[{"role": "user", "content": _image_content(file_id)}],
+        ) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    partial += event.delta
+                    on_delta(partial)
+            resp = await stream.get_final_response()
+    finally:
+        # remove o upload em segundo plano, sem segurar a resposta da página
+        task = asyncio.create_task(_delete_file(file_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    return resp
+
+
+async def analyze_text_formatting(images: list[bytes], force_refresh: bool = False, progress=None):
+    """
+    Analisa cada página em uma requisição própria, em paralelo (no máximo
+    MAX_CONCURRENT_PAGES de cada vez), e junta as seções na ordem das páginas.
+    Páginas já vistas (mesmos bytes e mesmo prompt) vêm do cache em disco.
+
+    Roda no event loop do cliente, fora da thread do Streamlit: o texto parcial
+    de cada página vai para o dict `progress` e falhas viram OCRError.
+    """
+    if progress is None:
+        progress = {}
+    keys = [_page_cache_key(data) for data in images]
+    results = [None if force_refresh else ocr_cache.get(key) for key in keys]
+    pending = [i for i, r in enumerate(results) if r is None]
+
+    if pending:
+        sem = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+
+        async def one(i):
+            async with sem:
+                return await _stream_page(images[i], lambda text: progress.__setitem__(i, text))
+
+        # return_exceptions: uma página que falha não descarta as que já terminaram
+        responses = await asyncio.gather(*(one(i) for i in pending), return_exceptions=True)
+
+        # guarda no cache as páginas que deram certo, mesmo se outra falhar
+        error = None
+        for i, resp in zip(pending, responses):
+            if isinstance(resp, BaseException):
+                if not isinstance(resp, Exception):
+                    raise resp  # cancelamento etc. não vira erro de página
+                error = error or OCRError(f"❌ Falha na chamada à API (página {i + 1}): {resp}")
+                continue
+            try:
+                page = _parse_page(_response_text(resp))
+            except OCRError as e:
+                error = error or e
+                continue
+            ocr_cache.set(keys[i], page)
+            results[i] = page
+
+        if error is not None:
+            raise error
+
+    sections = []
+    for page in results:
+        sections.extend(page["sections"])
+
+    return {"sections": sections}
+
+
+def run_ocr(images: list[bytes], force_refresh: bool = False):
+    """
+    Dispara o OCR e, enquanto espera, mostra o texto parcial de cada página.
+    Com force_refresh todas as páginas são reanalisadas, ignorando o cache em disco.
+    """
+    progress = {}
+    future = asyncio.run_coroutine_threadsafe(
+        analyze_text_formatting(images, force_refresh, progress), loop
+    )
+
+    placeholders = {}
+    shown = {}
+    try:
+        while not future.done():
+            for i, text in list(progress.items()):
+                if shown.get(i) != text:
+                    if i not in placeholders:
+                        placeholders[i] = st.empty()
+                    placeholders[i].text(text[-200:])
+                    shown[i] = text
+            futures.wait([future], timeout=PROGRESS_INTERVAL)
+    finally:
+        for placeholder in placeholders.values():
+            placeholder.empty()
+
+    return future.result()
 
 # =========================
 # HTML
@@ -228,7 +435,10 @@ def build_html_from_sections(data):
 
             if t == "li":
                 # remove um possível símbolo de bullet visual no início (•)
-                cleaned = re.sub(r"^\s*•\s*", "", text).strip()
+                cleaned = text.lstrip()
+                if cleaned.startswith("•"):
+                    cleaned = cleaned[1:]
+                cleaned = cleaned.strip()
                 buffer.append(f"<li>{cleaned}</li>")
             else:
                 # antes de adicionar um parágrafo, fecha qualquer <ul> aberto
@@ -243,6 +453,14 @@ def build_html_from_sections(data):
 # =========================
 # UI
 # =========================
+@st.cache_data(show_spinner=False)
+def preview_thumbnail(data: bytes):
+    """Miniatura da página para a pré-visualização (não envia o bitmap inteiro ao navegador)."""
+    thumb = Image.open(io.BytesIO(data))
+    thumb.thumbnail((PREVIEW_SIDE, PREVIEW_SIDE))
+    return thumb
+
+
 st.subheader("1) Envie a primeira página")
 st.warning("⚠️ **A ordem importa** — Página 1 deve vir primeiro. Se enviar fora de ordem, use a opção 'Inverter ordem'.", icon="⚠️")
 
@@ -255,56 +473,77 @@ with col2:
         img2 = st.file_uploader("Página 2 (opcional)", type=["jpg", "jpeg", "png", "bmp"])
 
 if img1:
+    # página enviada: o clique deve vir logo, então garante a conexão aberta
+    warm_up()
     st.write("### Pré-visualização das páginas (na ordem atual)")
     c1, c2 = st.columns(2)
     with c1:
-        st.image(Image.open(img1), caption="Página 1", use_column_width=True)
+        st.image(preview_thumbnail(img1.getvalue()), caption="Página 1", use_column_width=True)
     with c2:
         if img2:
-            st.image(Image.open(img2), caption="Página 2", use_column_width=True)
+            st.image(preview_thumbnail(img2.getvalue()), caption="Página 2", use_column_width=True)
         else:
             st.info("Nenhuma Página 2 enviada.")
 
 invert = img1 and st.checkbox("🗂️ Inverter ordem (Página 2 → Página 1)", value=False)
+force_refresh = st.checkbox("🔄 Forçar nova análise (ignorar cache)", value=False)
 
 st.write("---")
 run = st.button("🚀 Gerar HTML")
 
+# Decide order
+files = [img1, img2] if not invert else [img2, img1]
+files = [f for f in files if f]  # remove None
+
+# identifica o conjunto atual de páginas (na ordem): o último resultado só é
+# mostrado enquanto as mesmas páginas estiverem selecionadas
+doc_key = tuple(hashlib.sha256(f.getvalue()).hexdigest() for f in files)
+
 if run:
     if not img1:
         st.error("Envie ao menos a Página 1.")
     else:
-        # Decide order
-        files = [img1, img2] if not invert else [img2, img1]
-        files = [f for f in files if f]  # remove None
-
-        # Save temp files
-        paths = []
+        # Prepara os bytes de cada página
+        images = []
         for file in files:
-            img = Image.open(file)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                img.save(tmp.name)
-                paths.append(tmp.name)
-
+            data = file.getvalue()
+            # PNG/JPEG já no tamanho certo seguem como vieram; o PIL só entra para reduzir
+            size = _image_size(data)
+            if size is None or max(size) > MAX_IMAGE_SIDE:
+                # reduz e recomprime para baratear o envio
+                img = Image.open(io.BytesIO(data))
+                img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+                out = io.BytesIO()
+                _flatten_to_rgb(img).save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+                data = out.getvalue()
+            images.append(data)
+
+        st.info("🤖 Analisando com GPT-4o...")
         try:
-            st.info("🤖 Analisando com GPT-4o...")
-            result = analyze_text_formatting(paths)
-
-            if result:
-                st.success("✅ Processado!")
-                with st.expander("📄 JSON retornado"):
-                    st.json(result)
-
-                html = build_html_from_sections(result)
-                st.subheader("📝 Visualização")
-                st.markdown(html, unsafe_allow_html=True)
-
-                st.write("---")
-                st.subheader("📋 HTML para copiar")
-                st.code(html, language="html")
-            else:
-                st.error("❌ Erro no processamento.")
-        finally:
-            for p in paths:
-                if os.path.exists(p):
-                    os.remove(p)
+            result = run_ocr(images, force_refresh)
+        except OCRError as e:
+            st.error(str(e))
+            if e.response_text:
+                st.code(e.response_text)
+            result = None
+
+        if result:
+            # guardado na sessão: reruns (checkboxes etc.) continuam mostrando o resultado
+            st.session_state["ocr_result"] = {"key": doc_key, "result": result}
+        else:
+            st.error("❌ Erro no processamento.")
+
+last = st.session_state.get("ocr_result")
+if files and last and last["key"] == doc_key:
+    result = last["result"]
+    st.success("✅ Processado!")
+    with st.expander("📄 JSON retornado"):
+        st.json(result)
+
+    html = build_html_from_sections(result)
+    st.subheader("📝 Visualização")
+    st.markdown(html, unsafe_allow_html=True)
+
+    st.write("---")
+    st.subheader("📋 HTML para copiar")
+    st.code(html, language="html")
@@ -0,0 +1,116 @@
+"""
+Extração do JSON devolvido pelo modelo, que pode vir numa cerca ```json ...```
+ou misturado com texto ("Página [1]: {...}").
+
+Fica fora do main.py (que monta a UI ao ser importado) para poder ser
+conferido sozinho: `python -m doctest model_json.py`.
+"""
+import json
+import re
+
+import orjson
+
+_FENCE = "```"
+_OPEN_RE = re.compile(r"[{\[]")
+_CLOSE = {"{": "}", "[": "]"}
+
+
+def _fence_body(text: str):
+    """Conteúdo da primeira cerca ``` (sem o "json" da abertura), ou None."""
+    start = text.find(_FENCE)
+    if start < 0:
+        return None
+    start += len(_FENCE)
+    stop = text.find(_FENCE, start)
+    if stop < 0:
+        return None
+    if text.startswith("json", start):
+        start += 4
+    # espaços em volta não atrapalham o orjson
+    return text[start:stop]
+
+
+def _is_page(data) -> bool:
+    """Só um objeto, ou uma lista não vazia de objetos, pode ser o retorno de uma página."""
+    if isinstance(data, dict):
+        return True
+    return isinstance(data, list) and bool(data) and all(isinstance(it, dict) for it in data)
+
+
+def _decode_prefix(chunk: str):
+    """
+    Decodifica o documento JSON do início de `chunk`, ignorando texto depois dele.
+    Devolve (valor, fim); em erro, o `pos` da exceção diz até onde o parser leu.
+    """
+    try:
+        return orjson.loads(chunk), len(chunk)
+    except orjson.JSONDecodeError as e:
+        if not e.pos:
+            raise
+        # talvez o documento tenha terminado antes: tenta só o trecho já lido
+        try:
+            return orjson.loads(chunk[:e.pos]), e.pos
+        except orjson.JSONDecodeError:
+            raise e from None
+
+
+def extract_json_from_model_output(text: str):
+    """
+    Extrai JSON mesmo se vier com ruído ou ```json ...```.
+
+    Prefere o conteúdo da cerca; senão tenta cada { ou [ até o último
+    fechamento do mesmo tipo. Candidatos que não decodificam, ou que não são
+    objeto/lista de objetos, são descartados e a busca continua depois deles.
+    Assim "[1]" ou "[]" antes do JSON não viram uma página vazia no cache.
+
+    >>> extract_json_from_model_output('Aqui está:\\n```json\\n{"sections": []}\\n```')
+    {'sections': []}
+    >>> extract_json_from_model_output('Página [1]:\\n{"sections": []}')
+    {'sections': []}
+    >>> extract_json_from_model_output('```[]``` {"sections": []}')
+    {'sections': []}
+    >>> extract_json_from_model_output('Result (see [note]) {"sections": []}')
+    {'sections': []}
+    >>> extract_json_from_model_output('{"sections": []} (fim {nota})')
+    {'sections': []}
+    >>> extract_json_from_model_output('[{"type": "p", "text": "oi"}]')
+    [{'type': 'p', 'text': 'oi'}]
+
+    Um JSON truncado não vira um dos objetos de dentro dele:
+
+    >>> extract_json_from_model_output('{"sections": [{"heading": "A", "items": []}')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    JSONDecodeError: ...
+    """
+    if not text:
+        raise json.JSONDecodeError("empty", "", 0)
+
+    # orjson.JSONDecodeError herda de json.JSONDecodeError
+    error = None
+
+    fence = _fence_body(text)
+    if fence is not None:
+        try:
+            data, _ = _decode_prefix(fence)
+        except orjson.JSONDecodeError as e:
+            error = e
+        else:
+            if _is_page(data):
+                return data
+
+    m = _OPEN_RE.search(text)
+    while m:
+        start = m.start()
+        stop = text.rfind(_CLOSE[text[start]]) + 1
+        try:
+            data, end = _decode_prefix(text[start:stop])
+        except orjson.JSONDecodeError as e:
+            error = error or e
+            end = e.pos
+        else:
+            if _is_page(data):
+                return data
+        # o que o parser já leu pertence a este candidato: { [ aninhados não contam
+        m = _OPEN_RE.search(text, start + max(end, 1))
+
+    raise error or json.JSONDecodeError("nenhum objeto JSON encontrado", text, 0)